@@ -4,6 +4,78 @@ from utils import Move
 
 EMPTY = -1
 
+_NEIGHBOR_TABLES = {}
+_NEIGHBOR_MASK_TABLES = {}
+_COLUMN_MASKS = {}
+
+
+def neighbor_table(width, height):
+    """
+    King-move adjacency of a width x height grid, shared by all boards of that shape.
+    table[x][y] is a frozenset of the (row, col) cells touching (x, y), the cell itself excluded.
+    """
+    table = _NEIGHBOR_TABLES.get((width, height))
+    if table is None:
+        table = tuple(
+            tuple(
+                frozenset((x + i, y + j)
+                          for i in range(-1, 2)
+                          for j in range(-1, 2)
+                          if (i or j) and 0 <= x + i < height and 0 <= y + j < width)
+                for y in range(width)
+            )
+            for x in range(height)
+        )
+        _NEIGHBOR_TABLES[width, height] = table
+    return table
+
+
+def neighbor_mask_table(width, height):
+    """
+    The same adjacency as neighbor_table, as bitmasks over cell indices (row * width + col).
+    table[row * width + col] has a bit set for every neighbor of (row, col).
+    """
+    table = _NEIGHBOR_MASK_TABLES.get((width, height))
+    if table is None:
+        table = tuple(
+            sum(1 << (i * width + j) for i, j in cells)
+            for row in neighbor_table(width, height)
+            for cells in row
+        )
+        _NEIGHBOR_MASK_TABLES[width, height] = table
+    return table
+
+
+def mask_indices(mask):
+    """
+    The indices of the set bits of a bitmask, lowest first.
+    """
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+
+def ball(balls, depth):
+    """
+    The ball of the given depth from Board.balls, which stops growing once no new cell is reached.
+    """
+    return balls[min(depth, len(balls) - 1)]
+
+
+def column_masks(width, height):
+    """
+    Bitmasks of every cell not in the first column, every cell not in the last column, and every cell.
+    """
+    masks = _COLUMN_MASKS.get((width, height))
+    if masks is None:
+        all_cells = (1 << (width * height)) - 1
+        first_column = sum(1 << (x * width) for x in range(height))
+        last_column = first_column << (width - 1)
+        masks = (all_cells & ~first_column, all_cells & ~last_column, all_cells)
+        _COLUMN_MASKS[width, height] = masks
+    return masks
+
 
 class Board:
     def __init__(self, width, height, grid):
@@ -11,25 +83,27 @@ class Board:
         self.height = height
         self.size = width * height
         self.grid = np.copy(grid)
-        self.empty_cells = set()
+        self.neighbors = neighbor_table(width, height)
+        self.positions = np.full((self.size + 2, 2), EMPTY)
+        self._index_positions()
         self.update()
 
     def is_assigned(self, x):
-        return x in self.grid
+        return self.positions[x, 0] != EMPTY
+
+    def assigned_numbers(self):
+        return (np.flatnonzero(self.positions[1:self.size + 1, 0] != EMPTY) + 1).tolist()
 
     def is_complete(self):
-        return EMPTY not in self.grid
+        return self.num_assigned == self.size
 
     def is_consistent(self):
-        prev_y, prev_x = self._2d_index(1)
-
-        for i in range(2, self.width * self.height + 1):
-            y, x = self._2d_index(i)
-            if not self._are_attached(y, x, prev_y, prev_x):
-                return False
+        path = self.positions[1:self.size + 1]
+        if np.any(path == EMPTY):
+            return False
 
-            prev_y, prev_x = y, x
-        return True
+        steps = np.abs(np.diff(path, axis=0)).max(axis=1)
+        return bool(np.all(steps == 1))
 
     def is_correct(self):
         return self.is_complete() and self.is_consistent()
@@ -38,7 +112,7 @@ class Board:
         return self.grid[x, y]
 
     def set(self, x, y, number):
-        self.grid[x, y] = number
+        self[x, y] = number
 
     def neighbors_of(self, variable):
         if not self.is_assigned(variable):
@@ -48,18 +122,7 @@ class Board:
         return self.neighbors_of_index(x, y)
 
     def neighbors_of_index(self, x, y):
-        return {(i, j) for i, j in self._surrounding_indices(x, y) if self._is_in_grid(i, j)}
-
-    @staticmethod
-    def _surrounding_indices(x, y):
-        return {
-            (x + j, y + i)
-            for i in range(-1, 2)
-            for j in range(-1, 2)
-        }
-
-    def _is_in_grid(self, x, y):
-        return 0 <= x < self.height and 0 <= y < self.width
+        return self.neighbors[x][y]
 
     def is_variable_consistent(self, variable):
         neighbor_indices = self.neighbors_of(variable)
@@ -70,7 +133,14 @@ class Board:
         return self.grid[index_2d]
 
     def __setitem__(self, index_2d, number):
+        old_number = self.grid[index_2d]
+        if old_number != EMPTY and tuple(self.positions[old_number]) == tuple(index_2d):
+            self.positions[old_number] = EMPTY
+        self.num_assigned += int(number != EMPTY) - int(old_number != EMPTY)
         self.grid[index_2d] = number
+        self.empty[index_2d] = number == EMPTY
+        if number != EMPTY:
+            self.positions[number] = index_2d
 
     @staticmethod
     def _are_attached(x1, y1, x2, y2):
@@ -94,24 +164,111 @@ class Board:
             raise ValueError(f"Index {value} already assigned to a variable.")
 
         self.grid[value] = variable
-        self.update()
+        self.positions[variable] = value
+        self.empty[value] = False
+        self.num_assigned += 1
         return Move(*value, variable)
 
     def delete_assignment(self, variable):
         index = self._2d_index(variable)
         self.grid[index] = EMPTY
-        self.update()
+        self.positions[variable] = EMPTY
+        self.empty[index] = True
+        self.num_assigned -= 1
         return Move(*index, EMPTY)
 
     def _2d_index(self, variable):
-        return tuple(np.argwhere(self.grid == variable)[0])
+        x, y = self.positions[variable].tolist()
+        if x == EMPTY:
+            raise ValueError(f"The variable {variable} is not assigned.")
+        return x, y
+
+    def _index_positions(self):
+        self.positions[:] = EMPTY
+        rows, cols = np.nonzero(self.grid != EMPTY)
+        self.positions[self.grid[rows, cols]] = np.column_stack((rows, cols))
 
     def update(self):
-        self.empty_cells = {tuple(row) for row in np.argwhere(self.grid == EMPTY)}
+        self.empty = self.grid == EMPTY
+        self.num_assigned = self.size - int(np.count_nonzero(self.empty))
+
+    @property
+    def empty_cells(self):
+        return {(x, y) for x, y in np.argwhere(self.empty).tolist()}
+
+    def empty_mask(self):
+        """
+        The empty cells as an int bitmask over cell indices (row * width + col).
+        """
+        return int.from_bytes(np.packbits(self.empty, bitorder='little').tobytes(), 'little')
+
+    def grow_mask(self, mask):
+        """
+        The cells of a bitmask together with all their neighbors.
+        """
+        not_first_column, not_last_column, all_cells = column_masks(self.width, self.height)
+        row = mask | ((mask & not_last_column) << 1) | ((mask & not_first_column) >> 1)
+        return (row | (row << self.width) | (row >> self.width)) & all_cells
+
+    def balls(self, mask, depth, within):
+        """
+        balls[d] is the mask of the cells of mask and the cells of within at most d steps from them through within.
+        Stops growing early once no new cell is reached.
+        """
+        ball = mask
+        balls = [ball]
+        for _ in range(depth):
+            grown = ball | (self.grow_mask(ball) & within)
+            if grown == ball:
+                break
+            ball = grown
+            balls.append(ball)
+        return balls
+
+    def regions_of_mask(self, mask):
+        """
+        The groups of connected cells of a bitmask, as a bitmask each.
+        """
+        regions = []
+        remaining = mask
+        while remaining:
+            region = remaining & -remaining
+            while True:
+                grown = self.grow_mask(region) & mask
+                if grown == region:
+                    break
+                region = grown
+            regions.append(region)
+            remaining &= ~region
+        return regions
+
+    def neighbors_of_mask(self, mask):
+        """
+        The cells touching some cell of a bitmask. A cell of the mask is only included if it touches another one.
+        """
+        not_first_column, not_last_column, all_cells = column_masks(self.width, self.height)
+        sideways = ((mask & not_last_column) << 1) | ((mask & not_first_column) >> 1)
+        row = mask | sideways
+        return (sideways | (row << self.width) | (row >> self.width)) & all_cells
+
+    def cell_bit(self, x, y):
+        return 1 << (x * self.width + y)
+
+    def cells_of_mask(self, mask):
+        return [divmod(index, self.width) for index in mask_indices(mask)]
 
     def empty_neighbors(self, x, y):
-        return self.neighbors_of_index(x, y) & self.empty_cells
+        return {(i, j) for i, j in self.neighbors_of_index(x, y) if self.empty[i, j]}
 
     def copy(self):
-        return Board(self.width, self.height, self.grid.copy())
+        board = Board.__new__(Board)
+        board.width = self.width
+        board.height = self.height
+        board.size = self.size
+        board.neighbors = self.neighbors
+        board.grid = self.grid.copy()
+        board.positions = self.positions.copy()
+        board.empty = self.empty.copy()
+        board.num_assigned = self.num_assigned
+        return board
 
@@ -2,16 +2,23 @@ import os
 import random
 import subprocess
 
+from csp_solver import CSPSolver, MINIMUM_REMAINING_VALUES, LEAST_CONSTRAINING_VALUE
+from hidato_csp import HidatoCSP
+from propagators import DEFAULT_PROPAGATORS
 from utils import EMPTY
 
+UNIQUENESS_PROPAGATORS = DEFAULT_PROPAGATORS
+
 
 class HidatoGenerator:
     """
     Generate an Hidato grid with the given dimensions.
     """
 
-    def generate_grid(self, width, height, alpha=0.5):
+    def generate_grid(self, width, height, alpha=0.5, unique=False):
         grid = self._generate_puzzle_c(width, height)
+        if unique:
+            return self.omit_keeping_unique(width, height, grid, alpha=alpha)
         return self.omit_from_grid(width * height, grid, alpha=alpha)
 
     def _generate_puzzle_c(self, width, height):
@@ -32,6 +39,27 @@ class HidatoGenerator:
                 grid[i] = EMPTY
         return grid
 
+    def omit_keeping_unique(self, width, height, grid, alpha=0.5):
+        """
+        Like omit_from_grid, but a number is only removed when the puzzle still has a unique solution afterwards,
+        so fewer than alpha of the cells may end up empty.
+        """
+        size = width * height
+        to_remove = int(alpha * size)
+        for i in self.choices(list(range(size)), k=size):
+            if to_remove == 0:
+                break
+            number, grid[i] = grid[i], EMPTY
+            if self.count_solutions(width, height, grid, limit=2) == 1:
+                to_remove -= 1
+            else:
+                grid[i] = number
+        return grid
+
+    def count_solutions(self, width, height, grid, limit=None):
+        problem = HidatoCSP(width, height, grid, propagators=UNIQUENESS_PROPAGATORS)
+        return CSPSolver(problem).count_solutions(MINIMUM_REMAINING_VALUES, LEAST_CONSTRAINING_VALUE, True, limit)
+
     def choices(self, population, k=1):
         random.shuffle(population)
         return population[:k]
@@ -1,116 +1,461 @@
 import random
-from collections import defaultdict
+import time
+from collections import deque, namedtuple
+
+import numpy as np
 
 from hidato_csp import HidatoCSP
+from nogood_store import NogoodStore
 
 MINIMUM_REMAINING_VALUES = "MRV"
+MINIMUM_REMAINING_VALUES_BY_DEGREE = "MRV+degree"
+MINIMUM_REMAINING_VALUES_BY_GAP = "MRV+gap"
 LEAST_CONSTRAINING_VALUE = "LCV"
 
+SEARCHING = "searching"
+PAUSED = "paused"
+SOLVED = "solved"
+EXHAUSTED = "exhausted"
+OUT_OF_TIME = "out of time"
+CANCELLED = "cancelled"
 
-class CSPSolver:
-    def __init__(self, problem: HidatoCSP):
-        self.problem = problem
-        self._num_of_iterations = 0
+BUDGET_CHECK_INTERVAL = 64
 
-    def solve(self, select_variable, order_values, forward_checking):
-        select_variable_func = self._variable_by_order
-        if select_variable == MINIMUM_REMAINING_VALUES:
-            select_variable_func = self._minimum_remaining_values
+SearchStatistics = namedtuple('SearchStatistics', ['iterations', 'restarts', 'deepest', 'running_time'])
+SearchResult = namedtuple('SearchResult', ['status', 'grid', 'statistics'])
 
-        order_values_func = self._random_values
-        if order_values == LEAST_CONSTRAINING_VALUE:
-            order_values_func = self._least_constraining_value
 
-        self._num_of_iterations = 0
-        result = self._recursive_backtracking(select_variable_func, order_values_func, forward_checking)
-        return result
+def luby(index):
+    """
+    The index-th term, counting from 1, of the Luby sequence 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ...
+    """
+    while True:
+        exponent = (index + 1).bit_length() - 1
+        if index + 1 == 1 << exponent:
+            return 1 << (exponent - 1)
+        index -= (1 << exponent) - 1
 
-    def _recursive_backtracking(self, select_variable_func, order_values_func, forward_checking):
-        if self.problem.is_correct():
-            return self.problem
 
-        variable = select_variable_func()
-        if variable is None:
-            return
-        for value in order_values_func(variable):
-            old_domains = self.problem.get_domains_copy()
-            self._num_of_iterations += 1
-            self.problem.assign(variable, value)
+class ChoicePoint:
+    """
+    A variable being branched on, with its ordered values and the index of the next one to try.
+    When backjumping, conflicts holds the decision levels to blame for the values that failed or were pruned.
+    """
+
+    def __init__(self, variable, values):
+        self.variable = variable
+        self.values = values
+        self.next_value = 0
+        self.assigned = False
+        self.conflicts = set()
 
-            if forward_checking:
-                arcs = self.problem.get_arcs(variable)
+    def current_value(self):
+        return self.values[self.next_value - 1]
 
-                if not self.ac3(arcs):
-                    self.problem.delete_assignment(variable, old_domains)
-                    continue
+    def has_next_value(self):
+        return self.next_value < len(self.values)
 
-            result = self._recursive_backtracking(select_variable_func, order_values_func,
-                                                  forward_checking)
+    def take_next_value(self):
+        value = self.values[self.next_value]
+        self.next_value += 1
+        return value
 
-            if result is not None:
-                return self.problem
 
-            self.problem.delete_assignment(variable, old_domains)
+class CSPSolver:
+    """
+    Backtracking search over an explicit stack of choice points, so board size is not bound by the recursion limit
+    and a search can be paused and resumed.
+    """
+
+    def __init__(self, problem: HidatoCSP):
+        self.problem = problem
+        self._num_of_iterations = 0
+        self.stack = []
+        self.status = None
+        self._select_variable_func = self._variable_by_order
+        self._order_values_func = self._random_values
+        self._forward_checking = False
+        self._residues = {}
+        self._backjumping = False
+        self.nogoods = None
+        self._violated_nogood = None
+        self._placements = set()
+        self._random = random
+        self._restart_unit = 0
+        self._restart_limit = None
+        self._keep_nogoods = True
+        self._num_of_restarts = 0
+        self._deepest = None
+        self._deepest_assigned = -1
+
+    def solve(self, select_variable, order_values, forward_checking, backjumping=False, nogood_limit=0,
+              restart_unit=0, keep_nogoods=True):
+        self.start(select_variable, order_values, forward_checking, backjumping, nogood_limit, restart_unit,
+                   keep_nogoods)
+        return self.problem if self.status == SOLVED else self.resume()
+
+    def start(self, select_variable, order_values, forward_checking, backjumping=False, nogood_limit=0,
+              restart_unit=0, keep_nogoods=True):
+        """
+        Prepare a search. With backjumping, an exhausted variable jumps straight back to the deepest assignment in
+        its conflict set instead of the previous one, and the failed placements are remembered as nogoods in a
+        store of at most nogood_limit entries that blocks them in other branches.
+        With a restart_unit, the search starts over from the root with a reseeded value ordering whenever the
+        iterations since the last restart reach restart_unit times the next term of the Luby sequence.
+        Learned nogoods survive restarts unless keep_nogoods is False.
+        """
+        self._select_variable_func = self._variable_by_order
+        if select_variable == MINIMUM_REMAINING_VALUES:
+            self._select_variable_func = self._minimum_remaining_values
+        elif select_variable == MINIMUM_REMAINING_VALUES_BY_DEGREE:
+            self._select_variable_func = self._minimum_remaining_values_by_degree
+        elif select_variable == MINIMUM_REMAINING_VALUES_BY_GAP:
+            self._select_variable_func = self._minimum_remaining_values_by_gap
 
+        self._order_values_func = self._random_values
+        if order_values == LEAST_CONSTRAINING_VALUE:
+            self._order_values_func = self._least_constraining_value
+
+        self._forward_checking = forward_checking
+        self._residues = {}
+        self._backjumping = backjumping
+        self.nogoods = NogoodStore(nogood_limit) if backjumping and nogood_limit > 0 else None
+        self._random = random
+        self._restart_unit = restart_unit
+        self._restart_limit = restart_unit * luby(1) if restart_unit > 0 else None
+        self._keep_nogoods = keep_nogoods
+        self._num_of_restarts = 0
+        self._num_of_iterations = 0
+        # a previous search may have stopped midway, on a solution or on its budget
+        self._unwind()
+        self._placements = set()
+        self._deepest = None
+        self._deepest_assigned = -1
+        self.status = SEARCHING
+
+        if not self.problem.propagate() or (forward_checking and not self.ac3(self._all_arcs())):
+            self.status = EXHAUSTED
+        elif not self._expand():
+            self.status = SOLVED if self.problem.is_correct() else EXHAUSTED
+        if self.status != EXHAUSTED:
+            self._remember_if_deepest()
+
+    def solve_within(self, select_variable, order_values, forward_checking, max_iterations=None, deadline=None,
+                     cancel=None, backjumping=False, nogood_limit=0, restart_unit=0, keep_nogoods=True):
+        """
+        Solve with a budget of max_iterations iterations, until the time.monotonic() deadline, or until the cancel
+        token (anything with is_set(), such as a threading.Event) is set, whichever comes first.
+        Returns a SearchResult: the status, the solution or else the deepest consistent partial assignment
+        reached, with EMPTY in the unassigned cells, and the search statistics.
+        Calling it again starts over from the root with the new budget; resume() continues where the budget ran out.
+        """
+        start = time.monotonic()
+        self.start(select_variable, order_values, forward_checking, backjumping, nogood_limit, restart_unit,
+                   keep_nogoods)
+        if self.status != SOLVED:
+            self.resume(max_iterations, deadline, cancel)
+
+        grid = self.problem.board.grid.copy() if self.status == SOLVED else self._deepest
+        statistics = SearchStatistics(self._num_of_iterations, self._num_of_restarts, self._deepest_assigned,
+                                      time.monotonic() - start)
+        return SearchResult(self.status, grid, statistics)
+
+    def count_solutions(self, select_variable, order_values, forward_checking, limit=None):
+        """
+        Count the solutions, stopping as soon as limit of them were found. A puzzle has a unique solution when
+        count_solutions(..., limit=2) returns 1.
+        """
+        count = 0
+        for _ in self._solutions(select_variable, order_values, forward_checking):
+            count += 1
+            if limit is not None and count >= limit:
+                break
+        return count
+
+    def iter_solutions(self, select_variable, order_values, forward_checking):
+        """
+        Yield every solution as a read-only grid of the smallest unsigned type that fits the numbers.
+        The search only advances when the next solution is asked for.
+        """
+        dtype = np.min_scalar_type(self.problem.size)
+        for problem in self._solutions(select_variable, order_values, forward_checking):
+            solution = problem.board.grid.astype(dtype)
+            solution.flags.writeable = False
+            yield solution
+
+    def _solutions(self, select_variable, order_values, forward_checking):
+        self.start(select_variable, order_values, forward_checking)
+        if self.status != SOLVED:
+            self.resume()
+
+        try:
+            while self.status == SOLVED:
+                yield self.problem
+                self.resume()
+        finally:
+            # stopping early, say at a limit, leaves the problem as it was before the search
+            self._unwind()
+
+    def resume(self, max_iterations=None, deadline=None, cancel=None):
+        """
+        Continue the search until a solution is found, the search space is exhausted, the number of iterations
+        reaches max_iterations, the time.monotonic() deadline passes or the cancel token is set. The last two are
+        only checked every BUDGET_CHECK_INTERVAL iterations. Returns the problem when solved and None otherwise;
+        self.status tells which. Resuming after a solution continues to the next one.
+        """
+        if self.status not in (SEARCHING, PAUSED, OUT_OF_TIME, CANCELLED, SOLVED):
+            return
+        if self.status == SOLVED:
+            # restarting would find the same solutions again
+            self._restart_limit = None
+        if self.status == SOLVED and self._backjumping:
+            # a solution lies below every level, so none of them may be jumped over
+            for level, point in enumerate(self.stack, start=1):
+                point.conflicts.update(range(1, level))
+        self.status = SEARCHING
+
+        watched = deadline is not None or cancel is not None
+        next_check = self._num_of_iterations
+        while self.stack:
+            if max_iterations is not None and self._num_of_iterations >= max_iterations:
+                self.status = PAUSED
+                return
+
+            if watched and self._num_of_iterations >= next_check:
+                next_check = self._num_of_iterations + BUDGET_CHECK_INTERVAL
+                if deadline is not None and time.monotonic() >= deadline:
+                    self.status = OUT_OF_TIME
+                    return
+                if cancel is not None and cancel.is_set():
+                    self.status = CANCELLED
+                    return
+
+            if self._restart_limit is not None and self._num_of_iterations >= self._restart_limit:
+                self._restart()
+                continue
+
+            point = self.stack[-1]
+            if point.assigned:
+                self._unassign(point)
+
+            if not point.has_next_value():
+                self.stack.pop()
+                if self._backjumping:
+                    self._backjump(point.conflicts)
+                continue
+
+            if not self._try_assign(point.variable, point.take_next_value()):
+                if self._backjumping:
+                    point.conflicts |= self._failure_culprits()
+                continue
+            point.assigned = True
+            self._remember_if_deepest()
+
+            if not self._expand():
+                if self.problem.is_correct():
+                    self.status = SOLVED
+                    return self.problem
+                if self._backjumping:
+                    point.conflicts.update(range(1, len(self.stack)))
+
+        self.status = EXHAUSTED
         return
 
+    def _remember_if_deepest(self):
+        if self.problem.board.num_assigned > self._deepest_assigned:
+            self._deepest_assigned = self.problem.board.num_assigned
+            self._deepest = self.problem.board.grid.copy()
+
+    def split(self):
+        """
+        Give away the untried values of the shallowest assigned choice point that has any, as assignment prefixes
+        from the root of this search, one per value. The solver will not try them itself.
+        Returns an empty list when there is nothing to give away. Not meant to be mixed with backjumping.
+        """
+        for level, point in enumerate(self.stack):
+            if point.assigned and point.has_next_value():
+                prefix = [(above.variable, above.current_value()) for above in self.stack[:level]]
+                given_away = point.values[point.next_value:]
+                point.values = point.values[:point.next_value]
+                return [prefix + [(point.variable, value)] for value in given_away]
+        return []
+
+    def _try_assign(self, variable, value):
+        self._num_of_iterations += 1
+        if not self.problem.assign(variable, value):
+            self.problem.delete_assignment(variable)
+            return False
+
+        if self._forward_checking and not self.ac3(self._arcs_into_changed_domains()):
+            self.problem.delete_assignment(variable)
+            return False
+
+        self._placements.add((variable, value))
+        if self.nogoods is not None:
+            self._violated_nogood = self.nogoods.violated_by(variable, value, self._placements)
+            if self._violated_nogood is not None:
+                self._placements.discard((variable, value))
+                self.problem.delete_assignment(variable)
+                return False
+        return True
+
+    def _unassign(self, point):
+        self.problem.delete_assignment(point.variable)
+        self._placements.discard((point.variable, point.current_value()))
+        point.assigned = False
+
+    def _failure_culprits(self):
+        """
+        The levels to blame for the value that just failed at the top of the stack. Propagation failures are not
+        explained, so they blame every level above; a violated nogood blames the levels of its other placements.
+        """
+        level = len(self.stack)
+        nogood, self._violated_nogood = self._violated_nogood, None
+        if nogood is None:
+            return set(range(1, level))
+
+        levels = {point.variable: i for i, point in enumerate(self.stack, start=1)}
+        variable = self.stack[-1].variable
+        culprits = set()
+        for number, _ in nogood:
+            if number == variable:
+                continue
+            if number not in levels:
+                return set(range(1, level))
+            culprits.add(levels[number])
+        return culprits
+
+    def _backjump(self, conflicts):
+        """
+        Called with the conflict set of a choice point that ran out of values, after popping it.
+        Undoes every level below the deepest culprit, and passes the rest of the conflict set to the culprit.
+        """
+        target = max(conflicts, default=0)
+        if self.nogoods is not None:
+            self.nogoods.add((self.stack[level - 1].variable, self.stack[level - 1].current_value())
+                             for level in conflicts)
+
+        while len(self.stack) > target:
+            skipped = self.stack.pop()
+            if skipped.assigned:
+                self._unassign(skipped)
+
+        if self.stack:
+            self.stack[-1].conflicts |= conflicts - {target}
+
+    def _unwind(self):
+        """
+        Undo every assignment on the stack, which leaves the problem as it was at the root of the search.
+        """
+        while self.stack:
+            point = self.stack.pop()
+            if point.assigned:
+                self._unassign(point)
+
+    def _restart(self):
+        self._unwind()
+
+        self._num_of_restarts += 1
+        self._restart_limit = self._num_of_iterations + self._restart_unit * luby(self._num_of_restarts + 1)
+        self._random = random.Random(random.getrandbits(32))
+        if self.nogoods is not None and not self._keep_nogoods:
+            self.nogoods = NogoodStore(self.nogoods.capacity)
+        self._expand()
+
+    def _all_arcs(self):
+        return [arc for variable in self.problem.get_variables() for arc in self.problem.get_arcs(variable)]
+
+    def _arcs_into_changed_domains(self):
+        return [arc for changed in self.problem.get_changed_variables() for arc in self.problem.get_arcs(changed)]
+
+    def _expand(self):
+        """
+        Push a choice point for the next variable. Returns False when the board is complete, in which case
+        the caller validates the path once; every assignment respects the constraints.
+        """
+        if self.problem.is_complete():
+            return False
+
+        variable = self._select_variable_func()
+        values = self._order_values_func(variable) if variable is not None else []
+        point = ChoicePoint(variable, values)
+        if self._backjumping and variable is not None:
+            point.conflicts = self.problem.get_domain_culprits(variable)
+        self.stack.append(point)
+        return True
+
     def _variable_by_order(self):
         return min(var for var in self.problem.get_variables() if not self.problem.board.is_assigned(var))
 
     def _minimum_remaining_values(self):
-        def domain_size(var):
-            return len(self.problem.domains[var])
+        variables = self.problem.get_smallest_domain_variables()
+        return min(variables) if variables else None
 
-        sorted_variables = sorted(self.problem.get_unassigned_variables(), key=domain_size)
+    def _minimum_remaining_values_by_degree(self):
+        variables = self.problem.get_smallest_domain_variables()
+        return min(variables, key=lambda var: (-self.problem.get_degree(var), var)) if variables else None
 
-        return sorted_variables[0] if len(sorted_variables) > 0 else None
+    def _minimum_remaining_values_by_gap(self):
+        variables = self.problem.get_smallest_domain_variables()
+        return min(variables, key=lambda var: (self.problem.get_gap_length(var), var)) if variables else None
 
     def _random_values(self, variable):
         values = list(self.problem.domains[variable])
-        random.shuffle(values)
+        self._random.shuffle(values)
         return values
 
     def _least_constraining_value(self, variable):
-        occurrences = defaultdict(int)
-        for x in self.problem.get_unassigned_variables():
-            for val in self.problem.domains[x]:
-                occurrences[val] += 1
-
-        return sorted(self.problem.domains[variable], key=lambda a: occurrences[a])
-
-    def ac3(self, arcs_queue):
-        while arcs_queue:
-            y, x = arcs_queue.pop(0)
-
-            if self.revise(y, x):
-                if len(self.problem.domains[x]) == 0:
+        values = list(self.problem.domains[variable])
+        if self._num_of_restarts:
+            # break ties differently after every restart
+            self._random.shuffle(values)
+        return sorted(values, key=self.problem.get_occurrences)
+
+    def ac3(self, arcs):
+        """
+        Arc consistency over the chain of consecutive-number constraints, AC-2001 style: a deduplicated FIFO
+        worklist, and the last support found for every value is remembered and checked first. A domain store that
+        revises by mask removes the unsupported values of an arc in one word operation instead.
+        """
+        queue = deque(arcs)
+        queued = set(queue)
+        while queue:
+            arc = queue.popleft()
+            queued.discard(arc)
+            a, b = arc
+
+            if self.revise(a, b):
+                if self.problem.domains.size(a) == 0:
                     # inconsistency was found
                     return False
 
-                neighbors = set()
-                for arc in arcs_queue:
-                    if arc[0] == x and arc[1] != y:
-                        neighbors.add((arc[1], x))
-                    elif arc[1] == x and arc[0] != y:
-                        neighbors.add((arc[0], x))
-
-                arcs_queue.extend(neighbors)
+                for incoming in self.problem.get_arcs(a):
+                    if incoming[0] != b and incoming not in queued:
+                        queue.append(incoming)
+                        queued.add(incoming)
 
         return True
 
     def revise(self, a, b):
-        constraint_func = self.problem.get_binary_constraints(a, b)
+        if self.problem.domains.revises_by_mask:
+            return self.problem.keep_supported(a, b)
 
         revised = False
 
-        for a_value in self.problem.domains[a]:
-            satisfies = False
-            for b_value in self.problem.domains[b]:
-                if constraint_func(a_value, b_value):
-                    satisfies = True
-
-            if not satisfies:
-                self.problem.domains[a].remove(a_value)
+        for a_value in list(self.problem.domains[a]):
+            if not self._has_support(a, a_value, b):
+                self.problem.remove_from_domain(a, a_value)
                 revised = True
 
         return revised
+
+    def _has_support(self, a, a_value, b):
+        residue = self._residues.get((a, a_value, b))
+        if residue is not None and self.problem.domains.contains(b, residue):
+            return True
+
+        for b_value in self.problem.get_supports(a, a_value, b):
+            if self.problem.domains.contains(b, b_value):
+                self._residues[(a, a_value, b)] = b_value
+                return True
+        return False
@@ -0,0 +1,290 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+from Board import mask_indices, neighbor_mask_table
+
+
+class DomainStore(ABC):
+    """
+    Bookkeeping shared by the domain stores: the unassigned variables bucketed by domain size, moved between buckets
+    on every change, so the variables with the fewest remaining values are found without sorting.
+    """
+
+    def __init__(self, board):
+        self._buckets = [set() for _ in range(board.size + 1)]
+        self._bucket_of = {}
+        self._lowest_bucket = 0
+
+    @abstractmethod
+    def size(self, variable):
+        pass
+
+    def set_unassigned(self, variable):
+        size = self.size(variable)
+        self._buckets[size].add(variable)
+        self._bucket_of[variable] = size
+        self._lowest_bucket = min(self._lowest_bucket, size)
+
+    def set_assigned(self, variable):
+        self._buckets[self._bucket_of.pop(variable)].discard(variable)
+
+    def unassigned(self):
+        return self._bucket_of.keys()
+
+    def smallest_domain_variables(self):
+        """
+        The unassigned variables that share the smallest domain size.
+        """
+        for size in range(self._lowest_bucket, len(self._buckets)):
+            if self._buckets[size]:
+                self._lowest_bucket = size
+                return self._buckets[size]
+        return set()
+
+    def _resized(self, variable):
+        old_size = self._bucket_of.get(variable)
+        if old_size is None:
+            return
+        size = self.size(variable)
+        if size != old_size:
+            self._buckets[old_size].discard(variable)
+            self._buckets[size].add(variable)
+            self._bucket_of[variable] = size
+            self._lowest_bucket = min(self._lowest_bucket, size)
+
+
+class SetDomainStore(DomainStore):
+    """
+    Keeps every domain as a set of (row, col) cells, and the dual view: every cell's set of candidate numbers.
+    Mutations return the removed cells, which restore() puts back; remove_from_others returns them per number.
+    """
+    revises_by_mask = False
+
+    def __init__(self, board):
+        super().__init__(board)
+        self.board = board
+        self._domains = {}
+        self._candidates = defaultdict(set)
+
+    def __getitem__(self, variable):
+        return self._domains[variable]
+
+    def keys(self):
+        return self._domains.keys()
+
+    def set(self, variable, cells):
+        if variable in self._domains:
+            self._forget(variable, self._domains[variable])
+        self._domains[variable] = set(cells)
+        for cell in cells:
+            self._candidates[cell].add(variable)
+        self._resized(variable)
+
+    def candidates(self, cell):
+        return self._candidates[cell]
+
+    def occurrences(self, cell):
+        return len(self._candidates[cell])
+
+    def size(self, variable):
+        return len(self._domains[variable])
+
+    def contains(self, variable, cell):
+        return cell in self._domains[variable]
+
+    def cells_of(self, removed):
+        return removed
+
+    def remove(self, variable, cell):
+        domain = self._domains[variable]
+        if cell not in domain:
+            return set()
+        domain.remove(cell)
+        self._candidates[cell].discard(variable)
+        self._resized(variable)
+        return {cell}
+
+    def keep_only(self, variable, cell):
+        return self._keep(variable, {cell})
+
+    def keep_neighbors_of(self, variable, cell):
+        return self._keep(variable, self.board.neighbors_of_index(*cell))
+
+    def keep_within(self, variable, cells_mask):
+        width = self.board.width
+        return self._keep(variable, {(x, y) for x, y in self._domains[variable] if (cells_mask >> (x * width + y)) & 1})
+
+    def remove_from_others(self, variable, cell):
+        others = self._candidates[cell] - {variable}
+        for other in others:
+            self._domains[other].remove(cell)
+            self._resized(other)
+        self._candidates[cell] -= others
+        return [(other, {cell}) for other in others]
+
+    def _keep(self, variable, cells):
+        domain = self._domains[variable]
+        removed = domain - cells
+        domain -= removed
+        self._forget(variable, removed)
+        self._resized(variable)
+        return removed
+
+    def restore(self, variable, removed):
+        self._domains[variable] |= removed
+        for cell in removed:
+            self._candidates[cell].add(variable)
+        self._resized(variable)
+
+    def _forget(self, variable, cells):
+        for cell in cells:
+            self._candidates[cell].discard(variable)
+
+
+class CellSet:
+    """
+    Read-only set-like view of a cell bitmask, so heuristics can iterate a bitset domain like a set of cells.
+    cells[index] is the (row, col) cell of a cell index.
+    """
+    __slots__ = ('mask', 'width', 'cells')
+
+    def __init__(self, mask, width, cells):
+        self.mask = mask
+        self.width = width
+        self.cells = cells
+
+    def __len__(self):
+        return self.mask.bit_count()
+
+    def __bool__(self):
+        return self.mask != 0
+
+    def __contains__(self, cell):
+        x, y = cell
+        return (self.mask >> (x * self.width + y)) & 1 == 1
+
+    def __iter__(self):
+        mask = self.mask
+        while mask:
+            low_bit = mask & -mask
+            yield self.cells[low_bit.bit_length() - 1]
+            mask ^= low_bit
+
+
+class BitsetDomainStore(DomainStore):
+    """
+    Keeps every domain as an int bitmask over cell indices (row * width + col), and every cell's candidate
+    numbers as a bitmask over numbers.
+    Intersections, removals and sizes are word operations, and an arc is revised by intersecting a domain with the
+    neighborhood of another in one step; mutations return the removed bits.
+    """
+    revises_by_mask = True
+
+    def __init__(self, board):
+        super().__init__(board)
+        self.board = board
+        self.width = board.width
+        self._neighbor_masks = neighbor_mask_table(board.width, board.height)
+        self._cells = tuple(divmod(index, board.width) for index in range(board.size))
+        self._masks = {}
+        self._candidate_masks = [0] * board.size
+
+    def __getitem__(self, variable):
+        return CellSet(self._masks[variable], self.width, self._cells)
+
+    def keys(self):
+        return self._masks.keys()
+
+    def set(self, variable, cells):
+        if variable in self._masks:
+            self._forget(variable, self._masks[variable])
+        mask = 0
+        for cell in cells:
+            mask |= self._bit(cell)
+        self._masks[variable] = mask
+        self._remember(variable, mask)
+        self._resized(variable)
+
+    def candidates(self, cell):
+        x, y = cell
+        return list(mask_indices(self._candidate_masks[x * self.width + y]))
+
+    def occurrences(self, cell):
+        x, y = cell
+        return self._candidate_masks[x * self.width + y].bit_count()
+
+    def size(self, variable):
+        return self._masks[variable].bit_count()
+
+    def contains(self, variable, cell):
+        return self._masks[variable] & self._bit(cell) != 0
+
+    def cells_of(self, removed):
+        return CellSet(removed, self.width, self._cells)
+
+    def remove(self, variable, cell):
+        return self._keep(variable, ~self._bit(cell))
+
+    def keep_only(self, variable, cell):
+        return self._keep(variable, self._bit(cell))
+
+    def keep_neighbors_of(self, variable, cell):
+        x, y = cell
+        return self._keep(variable, self._neighbor_masks[x * self.width + y])
+
+    def keep_within(self, variable, cells_mask):
+        return self._keep(variable, cells_mask)
+
+    def keep_adjacent_to(self, variable, other):
+        return self._keep(variable, self.board.neighbors_of_mask(self._masks[other]))
+
+    def remove_from_others(self, variable, cell):
+        x, y = cell
+        index = x * self.width + y
+        bit = 1 << index
+        kept = self._candidate_masks[index] & (1 << variable)
+        others = self._candidate_masks[index] & ~kept
+        removed = []
+        while others:
+            other_bit = others & -others
+            other = other_bit.bit_length() - 1
+            self._masks[other] &= ~bit
+            self._resized(other)
+            removed.append((other, bit))
+            others ^= other_bit
+        self._candidate_masks[index] = kept
+        return removed
+
+    def _keep(self, variable, keep_mask):
+        mask = self._masks[variable]
+        removed = mask & ~keep_mask
+        if removed:
+            self._masks[variable] = mask & keep_mask
+            self._forget(variable, removed)
+            self._resized(variable)
+        return removed
+
+    def restore(self, variable, removed):
+        self._masks[variable] |= removed
+        self._remember(variable, removed)
+        self._resized(variable)
+
+    def _remember(self, variable, cells_mask):
+        variable_bit = 1 << variable
+        candidate_masks = self._candidate_masks
+        while cells_mask:
+            low_bit = cells_mask & -cells_mask
+            candidate_masks[low_bit.bit_length() - 1] |= variable_bit
+            cells_mask ^= low_bit
+
+    def _forget(self, variable, cells_mask):
+        variable_bit = ~(1 << variable)
+        candidate_masks = self._candidate_masks
+        while cells_mask:
+            low_bit = cells_mask & -cells_mask
+            candidate_masks[low_bit.bit_length() - 1] &= variable_bit
+            cells_mask ^= low_bit
+
+    def _bit(self, cell):
+        x, y = cell
+        return 1 << (x * self.width + y)
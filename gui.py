@@ -193,6 +193,7 @@ class HidatoUI(Frame):
         self.__set_cell(*second_cell, first_number)
 
     def __refresh_neighbors_bg_color(self, i, j):
+        self.__refresh_cell_bg_color(i, j)
         for neighbor in self.__view_board.neighbors_of_index(i, j):
             self.__refresh_cell_bg_color(*neighbor)
 
@@ -1,60 +1,223 @@
-from copy import deepcopy
+from bisect import bisect
 
+import numpy as np
+
+from domain_store import SetDomainStore
 from hidato_problem import HidatoProblem
 from collections import namedtuple
 
 Move = namedtuple('Move', ['index', 'number'])
 
+FORCED = 'forced'
+
 
 class HidatoCSP(HidatoProblem):
-    def __init__(self, width, height, grid):
+    def __init__(self, width, height, grid, domain_store=SetDomainStore, propagators=()):
         super().__init__(width, height, grid)
-        self.domains = {}
+        self.domains = domain_store(self.board)
         self.__initialize_domains()
         self.moves = []
+        self._trail = []
+        self._trail_marks = []
+        self._removal_levels = {x: [] for x in self.get_variables()}
+        self._pending = []
+        self.propagators = [propagator(self) for propagator in propagators]
 
     def get_variables(self):
         return range(1, self.size + 1)
 
     def __initialize_domains(self):
-        self.domains = {x: self.get_constraints(x) for x in self.get_variables()}
+        clues = [x for x in self.get_variables() if self.board.is_assigned(x)]
+        distances = {clue: self.__chebyshev_distances_from(clue) for clue in clues}
+
+        for x in self.get_variables():
+            domain = self.get_constraints(x)
+            if not self.board.is_assigned(x):
+                domain &= self.__cells_between_clues(x, clues, distances)
+            self.domains.set(x, domain)
+            if not self.board.is_assigned(x):
+                self.domains.set_unassigned(x)
+
+    def __chebyshev_distances_from(self, clue):
+        rows, cols = np.indices((self.height, self.width))
+        x, y = self.board._2d_index(clue)
+        return np.maximum(np.abs(rows - x), np.abs(cols - y))
+
+    def __cells_between_clues(self, x, clues, distances):
+        """
+        Empty cells that are at most x - a steps from the closest clue a below x,
+        and at most b - x steps from the closest clue b above it.
+        """
+        window = self.board.empty.copy()
+        i = bisect(clues, x)
+        if i > 0:
+            lower = clues[i - 1]
+            window &= distances[lower] <= x - lower
+        if i < len(clues):
+            upper = clues[i]
+            window &= distances[upper] <= upper - x
+        return {(row, col) for row, col in np.argwhere(window).tolist()}
 
     def get_domain(self, x):
         return self.domains[x]
 
-    def get_binary_constraints(self, x, y):
-        if abs(y - x) != 1:
-            return lambda a, b: True
+    def get_candidates(self, cell):
+        return self.domains.candidates(cell)
+
+    def get_occurrences(self, cell):
+        """
+        The number of domains the cell is in. An empty cell is only in the domains of unassigned variables.
+        """
+        return self.domains.occurrences(cell)
 
-        def constraint(a, b):
-            return self.board._are_attached(*a, *b)
+    def get_supports(self, x, value, y):
+        """
+        The values of y that may support x = value, to be checked against y's domain.
+        """
+        if abs(y - x) != 1:
+            return self.domains[y]
+        return self.board.neighbors_of_index(*value)
 
-        return constraint
+    def keep_supported(self, x, y):
+        """
+        Remove, in one domain store operation, the values of x that no value of y supports: only consecutive numbers
+        constrain each other, and x must then touch the domain of y. Returns whether any was removed.
+        """
+        if abs(y - x) != 1:
+            return False
+        removed = self.domains.keep_adjacent_to(x, y)
+        self.__record(x, removed)
+        return bool(removed)
 
     def get_constraints(self, x):
         if self.board.is_assigned(x):
             return {self.board._2d_index(x)}
 
-        elif x == 1 and self.board.is_assigned(2):
-            return self.board.neighbors_of(2) & self.board.empty_cells
+        elif self.board.is_assigned(x - 1) and self.board.is_assigned(x + 1):
+            return self.__empty_neighbors_of(x - 1) & self.board.neighbors_of(x + 1)
 
-        elif x == self.size and self.board.is_assigned(x - 1):
-            return self.board.neighbors_of(x - 1) & self.board.empty_cells
+        elif self.board.is_assigned(x - 1):
+            return self.__empty_neighbors_of(x - 1)
+
+        elif self.board.is_assigned(x + 1):
+            return self.__empty_neighbors_of(x + 1)
 
         else:
-            return (self.board.neighbors_of(x - 1) if self.board.is_assigned(x - 1) else self.board.empty_cells) \
-                   & (self.board.neighbors_of(x + 1) if self.board.is_assigned(x + 1) else self.board.empty_cells) \
-                   & self.board.empty_cells
+            return self.board.empty_cells
+
+    def __empty_neighbors_of(self, variable):
+        return self.board.empty_neighbors(*self.board._2d_index(variable))
 
     def assign(self, variable, value):
+        """
+        Assign and propagate. Returns False if propagation found a dead end; the assignment must then be deleted.
+        """
+        self._trail_marks.append(len(self._trail))
         move = self.board.assign(variable, value)
         self.moves.append(move)
+        self.domains.set_assigned(variable)
+        self.__update_domains_after_assignment(variable, value, direct=True)
+        return self.propagate(variable)
+
+    def propagate(self, variable=None):
+        """
+        Run the propagators after the given variable was assigned, or over the whole board if no variable is given.
+        Variables forced during propagation are propagated in turn, until a fixpoint or a dead end.
+        """
+        self._pending = [variable]
+        while self._pending:
+            variable = self._pending.pop()
+            if not all(propagator.propagate(variable) for propagator in self.propagators):
+                self._pending = []
+                return False
+        return True
+
+    def force(self, variable, value):
+        """
+        Assign a value propagation proved to be the only option, without opening a choice point.
+        It is undone by the delete_assignment of the assignment being propagated.
+        """
+        move = self.board.assign(variable, value)
+        self.moves.append(move)
+        self.domains.set_assigned(variable)
+        self._trail.append((variable, FORCED))
         self.__update_domains_after_assignment(variable, value)
+        self._pending.append(variable)
 
-    def delete_assignment(self, variable, old_domains):
+    def delete_assignment(self, variable):
+        """
+        Undo the latest assignment, which must be of the given variable, along with every domain change and forced
+        assignment made since.
+        """
         move = self.board.delete_assignment(variable)
         self.moves.append(move)
-        self.domains = old_domains
+        self.__undo_domain_changes()
+        self.domains.set_unassigned(variable)
+
+    def remove_from_domain(self, variable, value):
+        self.__record(variable, self.domains.remove(variable, value))
+
+    def keep_within(self, variable, cells_mask):
+        self.__record(variable, self.domains.keep_within(variable, cells_mask))
+
+    def __record(self, variable, removed, direct=False):
+        """
+        Put a domain removal on the trail, with the decision level it belongs to. Direct removals are caused by that
+        level's assignment alone; any other removal was derived by propagation from everything before it.
+        """
+        if removed:
+            self._trail.append((variable, removed))
+            self._removal_levels[variable].append((len(self._trail_marks), direct))
+
+    def __undo_domain_changes(self):
+        mark = self._trail_marks.pop()
+        while len(self._trail) > mark:
+            variable, removed = self._trail.pop()
+            if removed is FORCED:
+                self.moves.append(self.board.delete_assignment(variable))
+                self.domains.set_unassigned(variable)
+            else:
+                self.domains.restore(variable, removed)
+                self._removal_levels[variable].pop()
+
+    def get_domain_culprits(self, variable):
+        """
+        The decision levels whose assignments removed values from the variable's domain.
+        Removals derived by propagation blame every level up to theirs.
+        """
+        culprits = set()
+        derived_up_to = 0
+        for level, direct in self._removal_levels[variable]:
+            if direct:
+                culprits.add(level)
+            else:
+                derived_up_to = max(derived_up_to, level)
+        culprits.update(range(1, derived_up_to + 1))
+        culprits.discard(0)
+        return culprits
+
+    def get_changed_variables(self):
+        """
+        The variables whose domains changed since the latest assignment.
+        """
+        return {variable for variable, _ in self._trail[self._trail_marks[-1]:]}
+
+    def get_trail_position(self):
+        """
+        The current end of the trail, to pass to get_changes_since later.
+        """
+        return len(self._trail), self._trail[-1] if self._trail else None
+
+    def get_changes_since(self, position):
+        """
+        The (variable, removed cells) domain removals made since the trail position, or None if changes from before
+        it were undone since, in which case any domain may have changed.
+        """
+        length, last = position
+        if len(self._trail) < length or (length and self._trail[length - 1] is not last):
+            return None
+        return [(variable, self.domains.cells_of(removed)) for variable, removed in self._trail[length:]
+                if removed is not FORCED]
 
     def empty_neighbors(self, x, y):
         return self.board.empty_neighbors(x, y)
@@ -69,27 +232,44 @@ class HidatoCSP(HidatoProblem):
         return arcs
 
     def get_unassigned_variables(self):
-        return [v for v in self.get_variables() if not self.__is_assigned(v)]
+        return sorted(self.domains.unassigned())
+
+    def get_smallest_domain_variables(self):
+        return self.domains.smallest_domain_variables()
+
+    def get_degree(self, variable):
+        """
+        The number of unassigned variables sharing a constraint with the variable.
+        """
+        return sum(1 for other in (variable - 1, variable + 1)
+                   if 1 <= other <= self.size and not self.__is_assigned(other))
+
+    def get_gap_length(self, variable):
+        """
+        The length of the run of unassigned numbers the variable belongs to.
+        """
+        lower = variable - 1
+        while lower > 0 and not self.__is_assigned(lower):
+            lower -= 1
+        upper = variable + 1
+        while upper <= self.size and not self.__is_assigned(upper):
+            upper += 1
+        return upper - lower - 1
 
     def __is_assigned(self, v):
         return self.board.is_assigned(v)
 
-    def get_domains_copy(self):
-        return deepcopy(self.domains)
-
-    def __update_domains_after_assignment(self, variable, value):
-        self.domains[variable] = {value}
-        self.__update_consecutive_domains_after_assignment(variable)
-        self.__remove_value_from_other_domains(variable, value)
+    def __update_domains_after_assignment(self, variable, value, direct=False):
+        self.__record(variable, self.domains.keep_only(variable, value), direct)
+        self.__update_consecutive_domains_after_assignment(variable, value, direct)
+        self.__remove_value_from_other_domains(variable, value, direct)
 
-    def __update_consecutive_domains_after_assignment(self, variable):
-        neighbors = self.board.neighbors_of(variable)
+    def __update_consecutive_domains_after_assignment(self, variable, value, direct):
         if variable > 1:
-            self.domains[variable - 1] &= neighbors
+            self.__record(variable - 1, self.domains.keep_neighbors_of(variable - 1, value), direct)
         if variable < self.size:
-            self.domains[variable + 1] &= neighbors
+            self.__record(variable + 1, self.domains.keep_neighbors_of(variable + 1, value), direct)
 
-    def __remove_value_from_other_domains(self, variable, value):
-        for other in self.domains.keys():
-            if other != variable and value in self.domains[other]:
-                self.domains[other].remove(value)
+    def __remove_value_from_other_domains(self, variable, value, direct):
+        for other, removed in self.domains.remove_from_others(variable, value):
+            self.__record(other, removed, direct)
@@ -11,28 +11,38 @@ import pandas as pd
 import hill_climber
 from board_generator import HidatoGenerator
 from csp_solver import CSPSolver
+from domain_store import SetDomainStore, BitsetDomainStore
 from hidato_csp import HidatoCSP
+from hidato_problem import HidatoProblem
 from hidato_search_problem import HidatoSearchProblem
 from hill_climber import HillClimber
+from parallel_solver import ParallelSolver
+from portfolio_solver import PortfolioSolver
+from propagators import DEFAULT_PROPAGATORS
+from segment_solver import SegmentSolver
 from utils import _time_since
 from gui import HidatoUI
 
 DEFAULT_ALPHA = 0.5
 DEFAULT_DIMENSION = 5
-BENCHMARK_ITERATIONS = 10
+# enough runs for p95 and p99 to be observed runs other than the slowest one
+BENCHMARK_ITERATIONS = 200
+BENCHMARK_RESTART_UNIT = 100
+TAIL_PERCENTILES = (95, 99)
 MICROSECS_IN_SECS = 1e6
 THE_FUNNY_NUMBER = 42
 CSP_OUTPUT_FILENAME = 'csp_runtimes_{}_{}.csv'
 HILL_OUTPUT_FILENAME = "hill_loss.csv"
 
 
-def generate_hidato(width, height, alpha):
+def generate_hidato(width, height, alpha, unique=False):
     gen = HidatoGenerator()
-    return gen.generate_grid(width, height, alpha)
+    return gen.generate_grid(width, height, alpha, unique)
 
 
-def _solve_csp(width, height, grid, select_variable, order_values, forward_checking, show_gui=False):
-    problem = HidatoCSP(width, height, grid)
+def _solve_csp(width, height, grid, select_variable, order_values, forward_checking, show_gui=False, restart_unit=0,
+               domain_store=SetDomainStore, propagators=()):
+    problem = HidatoCSP(width, height, grid, domain_store=domain_store, propagators=propagators)
 
     if show_gui:
         gui = HidatoUI(problem, width)
@@ -40,7 +50,7 @@ def _solve_csp(width, height, grid, select_variable, order_values, forward_check
         problem.display()
 
     solver = CSPSolver(problem)
-    solver.solve(select_variable, order_values, forward_checking)
+    solver.solve(select_variable, order_values, forward_checking, restart_unit=restart_unit)
 
     if show_gui:
         gui.show_solve_steps(problem.moves)
@@ -48,6 +58,42 @@ def _solve_csp(width, height, grid, select_variable, order_values, forward_check
     return problem, solver._num_of_iterations
 
 
+def _solve_csp_portfolio(width, height, grid, domain_store=SetDomainStore, propagators=()):
+    problem = HidatoCSP(width, height, grid)
+    problem.display()
+
+    result = PortfolioSolver().solve(width, height, grid, domain_store=domain_store, propagators=propagators)
+    if result is None:
+        return problem
+
+    print(f'\n{result.configuration} won after {"{0:.4g}".format(result.running_time)} seconds '
+          f'and {result.iterations} iterations.')
+    return HidatoCSP(width, height, result.grid.flatten())
+
+
+def _solve_csp_parallel(width, height, grid, domain_store=SetDomainStore, propagators=()):
+    problem = HidatoCSP(width, height, grid)
+    problem.display()
+
+    result = ParallelSolver().solve(width, height, grid, domain_store=domain_store, propagators=propagators)
+    if result is None:
+        return problem
+
+    print(f'\nSolved in {"{0:.4g}".format(result.running_time)} seconds over {result.subtrees} subtrees.')
+    return HidatoCSP(width, height, result.grid.flatten())
+
+
+def _solve_segments(width, height, grid):
+    problem = HidatoProblem(width, height, grid)
+    problem.display()
+
+    solver = SegmentSolver(problem)
+    solver.solve()
+
+    print(f'\nSegment search {solver.status} after {solver._num_of_iterations} iterations.')
+    return problem
+
+
 def _solve_hill_climbing(width, height, grid, show_gui=False):
     problem = HidatoSearchProblem(width, height, grid)
 
@@ -65,32 +111,41 @@ def _solve_hill_climbing(width, height, grid, show_gui=False):
     return problem
 
 
-def benchmark_csp(width, height, grid, alpha):
+def benchmark_csp(width, height, grid, alpha, domain_store=SetDomainStore, propagators=()):
     select_variables_options = ["Ordered", "MRV"]
     order_values_options = ["Random", "LCV"]
     forward_checking = [True, False]
+    restart_units = [0, BENCHMARK_RESTART_UNIT]
 
     results = []
 
-    for select_var, order_values, fc in itertools.product(select_variables_options, order_values_options,
-                                                          forward_checking):
-        print(f'Benchmark CSP with {select_var}, {order_values}{", fc" if fc else ""}')
-        key = f"{select_var} & {order_values}{' & AC-3' if fc else ''}"
+    for select_var, order_values, fc, restart_unit in itertools.product(select_variables_options,
+                                                                        order_values_options, forward_checking,
+                                                                        restart_units):
+        print(f'Benchmark CSP with {select_var}, {order_values}{", fc" if fc else ""}'
+              f'{", restarts" if restart_unit else ""}')
+        key = f"{select_var} & {order_values}{' & AC-3' if fc else ''}{' & restarts' if restart_unit else ''}"
 
         running_time = []
         backtracking_steps = []
         for i in range(BENCHMARK_ITERATIONS):
             print(f'\titeration {i + 1}/{BENCHMARK_ITERATIONS}')
             start = time.time()
-            _, num_of_backtracking = _solve_csp(width, height, grid.copy(), select_var, order_values, fc, False)
+            _, num_of_backtracking = _solve_csp(width, height, grid.copy(), select_var, order_values, fc, False,
+                                                restart_unit, domain_store, propagators)
             time_since = _time_since(start)
             running_time.append(time_since)
             backtracking_steps.append(num_of_backtracking)
 
+        tail_times = [int(np.percentile(running_time, q, method='higher') * MICROSECS_IN_SECS)
+                      for q in TAIL_PERCENTILES]
         running_time = int(np.average(running_time) * MICROSECS_IN_SECS)
         num_of_backtracking = int(np.average(backtracking_steps))
+        print('\t' + ', '.join(f'p{q}={t}us' for q, t in zip(TAIL_PERCENTILES, tail_times)))
+
+        results.append((key, running_time, *tail_times, num_of_backtracking))
 
-        results.append((key, running_time, num_of_backtracking))
+    _print_tail_reduction(results)
 
     export_results_to_csv(results, alpha)
 
@@ -113,8 +168,20 @@ def benchmark_hill_climbing(width, height, grid, alpha):
     df.to_csv(HILL_OUTPUT_FILENAME)
 
 
+def _print_tail_reduction(results):
+    tails = {key: times for key, _, *times, _ in results}
+    for key, times in tails.items():
+        with_restarts = tails.get(f'{key} & restarts')
+        if with_restarts is None:
+            continue
+        print(f'{key}: restarts changed ' + ', '.join(
+            f'p{q} by {restarted / max(plain, 1):.2f}x'
+            for q, plain, restarted in zip(TAIL_PERCENTILES, times, with_restarts)))
+
+
 def export_results_to_csv(results, alpha):
-    df = pd.DataFrame(results, columns=["heuristic", "running time", "backtracking_steps"])
+    columns = ["heuristic", "running time", *[f"p{q} running time" for q in TAIL_PERCENTILES], "backtracking_steps"]
+    df = pd.DataFrame(results, columns=columns)
     df.to_csv(CSP_OUTPUT_FILENAME.format(alpha, datetime.datetime.now().__str__()))
 
 
@@ -123,10 +190,12 @@ def main():
     random.seed(THE_FUNNY_NUMBER)
 
     width = height = args.dimension
-    grid = generate_hidato(width, height, args.alpha)
+    grid = generate_hidato(width, height, args.alpha, args.unique)
+    domain_store = BitsetDomainStore if args.bitset else SetDomainStore
+    propagators = DEFAULT_PROPAGATORS if args.propagate else ()
 
     if args.benchmark and args.csp:
-        benchmark_csp(width, height, grid, args.alpha)
+        benchmark_csp(width, height, grid, args.alpha, domain_store, propagators)
         return
     elif args.benchmark and args.hill_climbing:
         benchmark_hill_climbing(width, height, grid, args.alpha)
@@ -136,9 +205,15 @@ def main():
 
     if args.hill_climbing:
         problem = _solve_hill_climbing(width, height, grid, args.gui)
+    elif args.csp and args.portfolio:
+        problem = _solve_csp_portfolio(width, height, grid, domain_store, propagators)
+    elif args.csp and args.parallel:
+        problem = _solve_csp_parallel(width, height, grid, domain_store, propagators)
+    elif args.segments:
+        problem = _solve_segments(width, height, grid)
     elif args.csp:
         problem, _ = _solve_csp(width, height, grid, select_variable="MRV", order_values="LCV", forward_checking=False,
-                                show_gui=args.gui)
+                                show_gui=args.gui, domain_store=domain_store, propagators=propagators)
 
     if not args.gui:
         print("\nAfter solve:")
@@ -165,9 +240,15 @@ def setup_arg_parser():
     parser.add_argument('--csp', dest='csp', action='store_true')
     parser.add_argument('--hill', dest='hill_climbing', action='store_true')
     parser.add_argument('--benchmark', dest='benchmark', action='store_true')
+    parser.add_argument('--portfolio', dest='portfolio', action='store_true')
+    parser.add_argument('--parallel', dest='parallel', action='store_true')
+    parser.add_argument('--segments', dest='segments', action='store_true')
+    parser.add_argument('--propagate', dest='propagate', default=False, action='store_true')
+    parser.add_argument('--bitset', dest='bitset', default=False, action='store_true')
     parser.add_argument('--dim', dest="dimension", default=DEFAULT_DIMENSION, type=int)
     parser.add_argument('--a', dest="alpha", default=DEFAULT_ALPHA, type=float)
     parser.add_argument('--gui', dest='gui', default=False, action='store_true')
+    parser.add_argument('--unique', dest='unique', default=False, action='store_true')
     return parser
 
 
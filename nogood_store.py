@@ -0,0 +1,45 @@
+from collections import OrderedDict, defaultdict
+
+
+class NogoodStore:
+    """
+    A bounded set of nogoods: sets of placements (variable, cell) that cannot all hold together.
+    When full, the least recently used nogood is evicted.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._nogoods = OrderedDict()
+        self._watching = defaultdict(set)
+
+    def __len__(self):
+        return len(self._nogoods)
+
+    def add(self, placements):
+        nogood = frozenset(placements)
+        if not nogood or self.capacity <= 0:
+            return
+
+        if nogood in self._nogoods:
+            self._nogoods.move_to_end(nogood)
+            return
+
+        self._nogoods[nogood] = None
+        for placement in nogood:
+            self._watching[placement].add(nogood)
+
+        while len(self._nogoods) > self.capacity:
+            evicted, _ = self._nogoods.popitem(last=False)
+            for placement in evicted:
+                self._watching[placement].discard(evicted)
+
+    def violated_by(self, variable, value, placements):
+        """
+        A stored nogood that placing the variable in the cell completes, or None.
+        placements is the set of current placements, the new one included.
+        """
+        for nogood in self._watching.get((variable, value), ()):
+            if nogood <= placements:
+                self._nogoods.move_to_end(nogood)
+                return nogood
+        return None
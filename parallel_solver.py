@@ -0,0 +1,136 @@
+import multiprocessing
+import queue
+import random
+import time
+from collections import namedtuple
+
+from csp_solver import CSPSolver, MINIMUM_REMAINING_VALUES, LEAST_CONSTRAINING_VALUE, SOLVED, EXHAUSTED
+from domain_store import SetDomainStore
+from hidato_csp import HidatoCSP
+
+STEAL_CHECK_INTERVAL = 64
+IDLE_POLL_SECONDS = 0.05
+
+ParallelResult = namedtuple('ParallelResult', ['grid', 'running_time', 'subtrees'])
+
+
+class _SharedState:
+    """
+    What the workers share: the queue of subtrees as assignment prefixes, the number of subtrees not yet finished,
+    the number of idle workers, the number of subtrees handed out so far, and the stop flag.
+    """
+
+    def __init__(self):
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.pending = multiprocessing.Value('i', 0)
+        self.idle = multiprocessing.Value('i', 0)
+        self.subtrees = multiprocessing.Value('i', 0)
+        self.stop = multiprocessing.Event()
+
+    def put(self, prefixes):
+        with self.pending.get_lock():
+            self.pending.value += len(prefixes)
+        with self.subtrees.get_lock():
+            self.subtrees.value += len(prefixes)
+        for prefix in prefixes:
+            self.tasks.put(prefix)
+
+    def finish(self):
+        with self.pending.get_lock():
+            self.pending.value -= 1
+            exhausted = self.pending.value == 0
+        if exhausted:
+            self.results.put(None)
+
+
+def _worker(index, shared, width, height, grid, domain_store, propagators, heuristics):
+    random.seed(index)
+    while not shared.stop.is_set():
+        with shared.idle.get_lock():
+            shared.idle.value += 1
+        try:
+            prefix = shared.tasks.get(timeout=IDLE_POLL_SECONDS)
+        except queue.Empty:
+            continue
+        finally:
+            with shared.idle.get_lock():
+                shared.idle.value -= 1
+
+        solution = _search_subtree(shared, prefix, width, height, grid, domain_store, propagators, heuristics)
+        if solution is not None:
+            shared.results.put(solution)
+            return
+        shared.finish()
+
+
+def _search_subtree(shared, prefix, width, height, grid, domain_store, propagators, heuristics):
+    problem = HidatoCSP(width, height, grid, domain_store=domain_store, propagators=propagators)
+    if not all(problem.assign(variable, value) for variable, value in prefix):
+        return None
+
+    solver = CSPSolver(problem)
+    solver.start(*heuristics)
+    while solver.status not in (SOLVED, EXHAUSTED) and not shared.stop.is_set():
+        solver.resume(solver._num_of_iterations + STEAL_CHECK_INTERVAL)
+        if shared.idle.value > 0 and shared.tasks.empty():
+            shared.put([list(prefix) + given_away for given_away in solver.split()])
+
+    return problem.board.grid.copy() if solver.status == SOLVED else None
+
+
+class ParallelSolver:
+    """
+    Split the search tree of a single puzzle across worker processes. Subtrees travel through a shared queue as
+    assignment prefixes, which a worker replays on a fresh HidatoCSP before searching below them.
+    The search starts as one subtree; whenever a worker is idle and the queue is empty, busy workers give away the
+    untried values of their shallowest choice point.
+    """
+
+    def __init__(self, select_variable=MINIMUM_REMAINING_VALUES, order_values=LEAST_CONSTRAINING_VALUE,
+                 forward_checking=True, processes=None):
+        self.heuristics = (select_variable, order_values, forward_checking)
+        self.processes = processes
+
+    def solve(self, width, height, grid, domain_store=SetDomainStore, propagators=()):
+        """
+        Returns a ParallelResult with the solved grid, the wall-clock time and the number of subtrees handed out,
+        or None when the puzzle has no solution.
+        """
+        processes = self.processes or multiprocessing.cpu_count()
+        shared = _SharedState()
+        shared.put([[]])
+
+        start = time.time()
+        workers = [multiprocessing.Process(target=_worker, daemon=True,
+                                           args=(index, shared, width, height, grid, domain_store,
+                                                 tuple(propagators), self.heuristics))
+                   for index in range(processes)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            solution = self._wait_for_result(shared, workers)
+        finally:
+            shared.stop.set()
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+
+        if solution is None:
+            return None
+        return ParallelResult(solution, time.time() - start, shared.subtrees.value)
+
+    def _wait_for_result(self, shared, workers):
+        """
+        Wait for a solution, or None once every subtree is exhausted. Raises RuntimeError if a worker dies, since
+        its subtree would never be finished.
+        """
+        while True:
+            try:
+                return shared.results.get(timeout=IDLE_POLL_SECONDS)
+            except queue.Empty:
+                pass
+            for worker in workers:
+                if worker.exitcode not in (None, 0):
+                    raise RuntimeError(f"Parallel worker {worker.name} died with exit code {worker.exitcode}.")
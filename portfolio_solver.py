@@ -0,0 +1,62 @@
+import itertools
+import multiprocessing
+import random
+import time
+from collections import namedtuple
+
+from csp_solver import CSPSolver, MINIMUM_REMAINING_VALUES, LEAST_CONSTRAINING_VALUE, SOLVED
+from domain_store import SetDomainStore
+from hidato_csp import HidatoCSP
+
+ORDERED_VARIABLES = "Ordered"
+RANDOM_VALUES = "Random"
+RANDOM_SEEDS = 4
+
+Configuration = namedtuple('Configuration', ['select_variable', 'order_values', 'forward_checking', 'restart_unit',
+                                             'seed'])
+PortfolioResult = namedtuple('PortfolioResult', ['grid', 'configuration', 'running_time', 'iterations'])
+
+DEFAULT_CONFIGURATIONS = tuple(
+    Configuration(select_variable, order_values, forward_checking, 0, seed)
+    for select_variable, order_values, forward_checking in itertools.product(
+        [MINIMUM_REMAINING_VALUES, ORDERED_VARIABLES], [LEAST_CONSTRAINING_VALUE, RANDOM_VALUES], [True, False])
+    for seed in (range(RANDOM_SEEDS) if order_values == RANDOM_VALUES else [0]))
+
+
+def _solve_configuration(task):
+    index, width, height, grid, domain_store, propagators, configuration = task
+    random.seed(configuration.seed)
+    problem = HidatoCSP(width, height, grid, domain_store=domain_store, propagators=propagators)
+    solver = CSPSolver(problem)
+    solver.solve(configuration.select_variable, configuration.order_values, configuration.forward_checking,
+                 restart_unit=configuration.restart_unit)
+    solution = problem.board.grid.copy() if solver.status == SOLVED else None
+    return index, solution, solver._num_of_iterations
+
+
+class PortfolioSolver:
+    """
+    Race several CSPSolver configurations on the same puzzle in a process pool.
+    The first configuration to solve it wins and the rest are terminated. Configurations are started in order,
+    so the strongest ones come first when there are fewer processes than configurations.
+    """
+
+    def __init__(self, configurations=DEFAULT_CONFIGURATIONS, processes=None):
+        self.configurations = list(configurations)
+        self.processes = processes
+
+    def solve(self, width, height, grid, domain_store=SetDomainStore, propagators=()):
+        """
+        Returns a PortfolioResult with the solved grid, the winning configuration, the wall-clock time until it won
+        and its number of iterations, or None when every configuration exhausted the search.
+        """
+        tasks = [(index, width, height, grid, domain_store, tuple(propagators), configuration)
+                 for index, configuration in enumerate(self.configurations)]
+        processes = self.processes or min(len(tasks), multiprocessing.cpu_count())
+
+        start = time.time()
+        with multiprocessing.Pool(processes) as pool:
+            for index, solution, iterations in pool.imap_unordered(_solve_configuration, tasks):
+                if solution is not None:
+                    return PortfolioResult(solution, self.configurations[index], time.time() - start, iterations)
+        return None
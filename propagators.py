@@ -0,0 +1,344 @@
+from collections import defaultdict
+
+from Board import ball
+from utils import subset_sums
+
+
+class ReachabilityPropagator:
+    """
+    Every unplaced number k between placed numbers a < b lies on a path of empty cells from a to b,
+    so it must be within k - a steps of a and b - k steps of b, walking through empty cells only.
+    Prunes the domains to those cells and fails when a gap cannot be closed at all.
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+
+    def propagate(self, variable=None):
+        board = self.problem.board
+        placed = board.assigned_numbers()
+        if not placed:
+            return True
+
+        empty = board.empty_mask()
+        bounds = [0] + placed + [self.problem.size + 1]
+        gaps = [(lower, upper) for lower, upper in zip(bounds, bounds[1:]) if upper - lower > 1]
+
+        depths = defaultdict(int)
+        for lower, upper in gaps:
+            depths[lower] = max(depths[lower], upper - lower)
+            depths[upper] = max(depths[upper], upper - lower)
+        balls = {number: self._balls(number, depth, empty) for number, depth in depths.items()}
+
+        for lower, upper in gaps:
+            if not self._can_close(lower, upper, balls):
+                return False
+
+            for k in range(lower + 1, upper):
+                self.problem.keep_within(k, ball(balls[lower], k - lower) & ball(balls[upper], upper - k))
+                if self.problem.domains.size(k) == 0:
+                    return False
+        return True
+
+    def _can_close(self, lower, upper, balls):
+        if lower == 0 or upper == self.problem.size + 1:
+            return True
+
+        board = self.problem.board
+        last_step = ball(balls[lower], upper - lower - 1)
+        return board.grow_mask(last_step) & board.cell_bit(*board._2d_index(upper)) != 0
+
+    def _balls(self, number, depth, empty):
+        """
+        balls[d] is the mask of the number's cell and the empty cells at most d steps from it through empty cells.
+        The bounds 0 and size + 1 reach every empty cell.
+        """
+        if not 1 <= number <= self.problem.size:
+            return [empty]
+
+        board = self.problem.board
+        return board.balls(board.cell_bit(*board._2d_index(number)), depth, empty)
+
+
+class AllDifferentPropagator:
+    """
+    Régin's all-different filtering between the unplaced numbers and the empty cells.
+    There are as many unplaced numbers as empty cells, so every number needs its own cell: fails when no perfect
+    matching exists, and removes every value that belongs to no perfect matching. The last matching is kept to
+    warm-start the next call.
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+        self._matching = {}
+
+    def propagate(self, variable=None):
+        variables = self.problem.get_unassigned_variables()
+        domains = {variable: list(self.problem.domains[variable]) for variable in variables}
+
+        matching, owners = self._maximum_matching(variables, domains)
+        if len(matching) < len(variables):
+            return False
+        self._matching = matching
+
+        successors = {variable: [owners[cell] for cell in domains[variable] if cell != matching[variable]]
+                      for variable in variables}
+        component = self._strongly_connected_components(variables, successors)
+
+        for variable in variables:
+            for cell in domains[variable]:
+                if cell != matching[variable] and component[variable] != component[owners[cell]]:
+                    self.problem.remove_from_domain(variable, cell)
+        return True
+
+    def _maximum_matching(self, variables, domains):
+        matching, owners = {}, {}
+        for variable in variables:
+            cell = self._matching.get(variable)
+            if cell is not None and cell not in owners and cell in domains[variable]:
+                matching[variable] = cell
+                owners[cell] = variable
+
+        for variable in variables:
+            if variable not in matching and not self._augment(variable, domains, matching, owners):
+                break
+        return matching, owners
+
+    @staticmethod
+    def _augment(root, domains, matching, owners):
+        """
+        Looks for an alternating path from an unmatched variable to a free cell, and flips it.
+        """
+        visited = set()
+        path_variables = [root]
+        path_cells = []
+        stack = [iter(domains[root])]
+        while stack:
+            cell = next((cell for cell in stack[-1] if cell not in visited), None)
+            if cell is None:
+                stack.pop()
+                path_variables.pop()
+                if path_cells:
+                    path_cells.pop()
+                continue
+
+            visited.add(cell)
+            path_cells.append(cell)
+            owner = owners.get(cell)
+            if owner is None:
+                for variable, chosen in zip(path_variables, path_cells):
+                    matching[variable] = chosen
+                    owners[chosen] = variable
+                return True
+
+            path_variables.append(owner)
+            stack.append(iter(domains[owner]))
+        return False
+
+    @staticmethod
+    def _strongly_connected_components(nodes, successors):
+        """
+        Iterative Tarjan. Maps every node to the root of its component.
+        """
+        index, low, component = {}, {}, {}
+        stack, on_stack = [], set()
+
+        def visit(node):
+            index[node] = low[node] = len(index)
+            stack.append(node)
+            on_stack.add(node)
+            work.append((node, iter(successors[node])))
+
+        for root in nodes:
+            if root in index:
+                continue
+            work = []
+            visit(root)
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        visit(child)
+                        break
+                    elif child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component[member] = node
+                            if member == node:
+                                break
+        return component
+
+
+class ConnectivityPropagator:
+    """
+    The path visits every empty cell, so:
+    - an empty cell needs two neighbors the path can come from and go to (one if it may hold 1 or the last number):
+      empty cells, or placed numbers that still miss a consecutive number;
+    - every region of connected empty cells is filled by whole gaps between placed numbers that touch it, so its size
+      must be a sum of such gap lengths.
+    Only the cells around the latest assignment have their degree rechecked. The regions are kept for every board
+    along the current search path, and derived from the closest one when a single cell was filled since without
+    splitting its region; otherwise they are flood filled again. The gap sums are always rechecked.
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+        self._path_regions = []
+
+    def propagate(self, variable=None):
+        board = self.problem.board
+        empty = board.empty_mask()
+        if variable is None:
+            touched = empty
+        else:
+            touched = 0
+            for number in (variable - 1, variable, variable + 1):
+                if 1 <= number <= self.problem.size and board.is_assigned(number):
+                    touched |= board.grow_mask(board.cell_bit(*board._2d_index(number)))
+            touched &= empty
+
+        return all(self._has_free_degree(cell) for cell in board.cells_of_mask(touched)) \
+            and self._regions_fit_gaps(empty)
+
+    def _has_free_degree(self, cell):
+        board = self.problem.board
+        free = 0
+        for neighbor in board.neighbors_of_index(*cell):
+            if board.empty[neighbor] or self._is_open(board.grid[neighbor]):
+                free += 1
+                if free == 2:
+                    return True
+        return free == 1 and (self._may_hold(1, cell) or self._may_hold(self.problem.size, cell))
+
+    def _is_open(self, number):
+        board = self.problem.board
+        return (number > 1 and not board.is_assigned(number - 1)) \
+            or (number < self.problem.size and not board.is_assigned(number + 1))
+
+    def _may_hold(self, number, cell):
+        return not self.problem.board.is_assigned(number) and self.problem.domains.contains(number, cell)
+
+    def _regions_fit_gaps(self, empty):
+        board = self.problem.board
+        placed = board.assigned_numbers()
+        bounds = [0] + placed + [self.problem.size + 1]
+        gaps = [(self._touching(lower), self._touching(upper), upper - lower - 1)
+                for lower, upper in zip(bounds, bounds[1:]) if upper - lower > 1]
+
+        fitting = [False] * len(gaps)
+        for region in self._current_regions(empty):
+            lengths = []
+            for i, (lower_touch, upper_touch, length) in enumerate(gaps):
+                if lower_touch & region and upper_touch & region:
+                    lengths.append(length)
+                    fitting[i] = True
+            if not (subset_sums(lengths) >> region.bit_count()) & 1:
+                return False
+        return all(fitting)
+
+    def _touching(self, number):
+        """
+        The cells next to a placed number; the bounds 0 and size + 1 touch every cell.
+        """
+        board = self.problem.board
+        if not 1 <= number <= self.problem.size:
+            return ~0
+        return board.grow_mask(board.cell_bit(*board._2d_index(number)))
+
+    def _current_regions(self, empty):
+        # the boards still on the search path have every cell that is empty now empty too
+        while self._path_regions and empty & ~self._path_regions[-1][0]:
+            self._path_regions.pop()
+        board = self.problem.board
+        if not self._path_regions:
+            regions = board.regions_of_mask(empty)
+        else:
+            path_empty, path_regions = self._path_regions[-1]
+            filled = path_empty & ~empty
+            if not filled:
+                return path_regions
+            if filled & (filled - 1) or self._splits(filled, empty):
+                regions = board.regions_of_mask(empty)
+            else:
+                regions = [region & ~filled for region in path_regions if region != filled]
+        self._path_regions.append((empty, regions))
+        return regions
+
+    def _splits(self, filled, empty):
+        """
+        Whether filling a cell may split its region: the empty cells around it are not connected to each other.
+        """
+        board = self.problem.board
+        return len(board.regions_of_mask(board.grow_mask(filled) & empty)) > 1
+
+
+class SinglesPropagator:
+    """
+    Places without branching every naked single (a number with one candidate cell) and every hidden single
+    (an empty cell only one number can take), until none is left.
+    Fails on a number with no candidate cell or an empty cell no number can take.
+    Only the numbers and cells whose domains changed since the last fixpoint are rechecked, unless changes were undone
+    since, which rechecks the whole board.
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+        self._position = None
+
+    def propagate(self, variable=None):
+        changes = None
+        if variable is not None and self._position is not None:
+            changes = self.problem.get_changes_since(self._position)
+        if changes is None:
+            board = self.problem.board
+            numbers, cells = self.problem.get_unassigned_variables(), board.cells_of_mask(board.empty_mask())
+        else:
+            numbers, cells = self._touched(changes)
+
+        while numbers or cells:
+            self._position = self.problem.get_trail_position()
+            if not self._force_singles(numbers, cells):
+                return False
+            numbers, cells = self._touched(self.problem.get_changes_since(self._position))
+        return True
+
+    @staticmethod
+    def _touched(changes):
+        numbers, cells = set(), set()
+        for number, removed in changes:
+            numbers.add(number)
+            cells.update(removed)
+        return numbers, cells
+
+    def _force_singles(self, numbers, cells):
+        board = self.problem.board
+        for number in numbers:
+            if board.is_assigned(number):
+                continue
+            size = self.problem.domains.size(number)
+            if size == 0:
+                return False
+            if size == 1:
+                self.problem.force(number, next(iter(self.problem.domains[number])))
+
+        for cell in cells:
+            if not board.empty[cell]:
+                continue
+            occurrences = self.problem.get_occurrences(cell)
+            if occurrences == 0:
+                return False
+            if occurrences == 1:
+                number, = self.problem.get_candidates(cell)
+                self.problem.force(number, cell)
+        return True
+
+
+DEFAULT_PROPAGATORS = (ReachabilityPropagator, ConnectivityPropagator, SinglesPropagator)
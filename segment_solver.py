@@ -0,0 +1,331 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from functools import reduce
+from operator import and_, or_
+
+from Board import neighbor_mask_table, mask_indices, ball
+from csp_solver import ChoicePoint, SEARCHING, PAUSED, SOLVED, EXHAUSTED
+from hidato_problem import HidatoProblem
+from utils import subset_sums
+
+ENUMERATION_MAX_LENGTH = 6
+PATH_LIMIT = 64
+PATH_CACHE_SIZE = 4096
+
+
+class SegmentSolver:
+    """
+    Solve Hidato one segment at a time. A segment is a gap between placed numbers a < b, which needs a path of
+    b - a steps through empty cells, or the open run before the smallest or after the largest placed number.
+    Every node checks that each segment can still be walked and that every empty cell is within reach of some
+    segment. It then places the number with the fewest cells left, or fills a whole short segment in one step when
+    it has a single path or fewer paths than that number has cells.
+    Path enumerations are cached by the segment's end cells, length and the empty cells it may use.
+    Works on the board alone, so it takes any HidatoProblem.
+    """
+
+    def __init__(self, problem: HidatoProblem):
+        self.problem = problem
+        board = problem.board
+        self._neighbors = neighbor_mask_table(board.width, board.height)
+        self._paths = OrderedDict()
+        self._num_of_iterations = 0
+        self.stack = []
+        self.status = None
+
+    def solve(self, max_iterations=None):
+        self.start()
+        return self.problem if self.status == SOLVED else self.resume(max_iterations)
+
+    def start(self):
+        board = self.problem.board
+        self._empty = board.empty_mask()
+        self._placed = board.assigned_numbers()
+        self._num_of_iterations = 0
+        self.stack = []
+        self.status = SEARCHING
+
+        consecutive = [(a, b) for a, b in zip(self._placed, self._placed[1:]) if b == a + 1]
+        if not all(self._neighbors[self._cell(a)] >> self._cell(b) & 1 for a, b in consecutive):
+            self.status = EXHAUSTED
+        elif not self._expand():
+            self.status = SOLVED if board.is_correct() else EXHAUSTED
+
+    def resume(self, max_iterations=None):
+        """
+        Continue the search until a solution is found, the search space is exhausted, or the number of iterations
+        reaches max_iterations. Returns the problem when solved and None otherwise; self.status tells which.
+        """
+        if self.status not in (SEARCHING, PAUSED):
+            return
+        self.status = SEARCHING
+
+        while self.stack:
+            if max_iterations is not None and self._num_of_iterations >= max_iterations:
+                self.status = PAUSED
+                return
+
+            point = self.stack[-1]
+            if point.assigned:
+                self._unplace(point.current_value())
+                point.assigned = False
+
+            if not point.has_next_value():
+                self.stack.pop()
+                continue
+
+            self._num_of_iterations += 1
+            self._place(point.take_next_value())
+            point.assigned = True
+
+            if not self._expand() and self.problem.board.is_correct():
+                self.status = SOLVED
+                return self.problem
+
+        self.status = EXHAUSTED
+        return
+
+    def _expand(self):
+        """
+        Push a choice point for the next segment. Returns False when the board is complete.
+        A dead end pushes a choice point without alternatives.
+        """
+        if self.problem.board.is_complete():
+            return False
+
+        segment, alternatives = self._branch()
+        self.stack.append(ChoicePoint(segment, alternatives))
+        return True
+
+    def _branch(self):
+        segments = self._segments()
+        reaches = {segment: self._reach(*segment) for segment in segments}
+        regions = {segment: self._region(*segment, reaches[segment]) for segment in segments}
+        paths = {}
+        for lower, upper in segments:
+            if 0 < lower and upper <= self.problem.size and upper - lower - 1 <= ENUMERATION_MAX_LENGTH:
+                enumerated = self._enumerate_paths(lower, upper, regions[lower, upper])
+                if enumerated == []:
+                    return None, []
+                if enumerated is not None:
+                    paths[lower, upper] = enumerated
+
+        if not self._has_few_dead_ends(segments) or not self._narrow(segments, regions, paths) \
+                or not self._components_fit(segments, regions):
+            return None, []
+
+        segment, alternatives = self._placement(segments, regions, reaches)
+        if paths:
+            tightest = min(paths, key=lambda segment: (len(paths[segment]), segment[1] - segment[0]))
+            if len(paths[tightest]) == 1 or len(paths[tightest]) < len(alternatives):
+                numbers = range(tightest[0] + 1, tightest[1])
+                return tightest, [tuple(zip(numbers, path)) for path, _ in paths[tightest]]
+        return segment, alternatives
+
+    def _narrow(self, segments, regions, paths):
+        """
+        Shrink the regions and path lists in place until they agree. A cell only one segment can reach, or one
+        every path of a segment passes through, is claimed by that segment and taken out of all the others.
+        Returns False when some segment can no longer be walked or some empty cell can no longer be covered.
+        """
+        changed = True
+        while changed:
+            covered = covered_twice = 0
+            for region in regions.values():
+                covered_twice |= covered & region
+                covered |= region
+            if covered != self._empty:
+                return False
+
+            claimed = {}
+            all_claimed = 0
+            for segment, region in regions.items():
+                cells = region & ~covered_twice
+                if segment in paths:
+                    cells |= reduce(and_, (mask for _, mask in paths[segment]))
+                if cells & all_claimed or cells.bit_count() > self._length(*segment):
+                    return False
+                claimed[segment] = cells
+                all_claimed |= cells
+
+            changed = False
+            for segment in segments:
+                foreign = all_claimed & ~claimed[segment]
+                if segment in paths:
+                    kept = [(path, mask) for path, mask in paths[segment] if not mask & foreign]
+                    if not kept:
+                        return False
+                    if len(kept) < len(paths[segment]):
+                        paths[segment] = kept
+                        regions[segment] = reduce(or_, (mask for _, mask in kept))
+                        changed = True
+                elif regions[segment] & foreign:
+                    regions[segment] &= ~foreign
+                    if regions[segment].bit_count() < self._length(*segment):
+                        return False
+                    changed = True
+        return True
+
+    def _components_fit(self, segments, regions):
+        """
+        A segment fills a path of connected empty cells, so each connected group of empty cells is filled by whole
+        segments that can reach it, and its size must be a sum of their lengths.
+        """
+        for component in self.problem.board.regions_of_mask(self._empty):
+            sums = subset_sums(self._length(*segment) for segment in segments if regions[segment] & component)
+            if not (sums >> component.bit_count()) & 1:
+                return False
+        return True
+
+    def _has_few_dead_ends(self, segments):
+        """
+        An empty cell lies between two consecutive numbers unless it holds 1 or the last number, so it needs two
+        neighbors that are empty or hold a number still missing a neighbor in the path. Only as many cells as there
+        are unplaced path ends may have just one.
+        """
+        size = self.problem.size
+        open_ends = 0
+        for lower, upper in segments:
+            if lower > 0:
+                open_ends |= 1 << self._cell(lower)
+            if upper <= size:
+                open_ends |= 1 << self._cell(upper)
+
+        usable = self._empty | open_ends
+        allowed = (segments[0][0] == 0) + (segments[-1][1] == size + 1)
+        for cell in mask_indices(self._empty):
+            degree = (self._neighbors[cell] & usable).bit_count()
+            if degree < 2:
+                allowed -= 1
+                if degree == 0 or allowed < 0:
+                    return False
+        return True
+
+    def _placement(self, segments, regions, reaches):
+        """
+        Branch on the cell of the unplaced number with the fewest cells left, preferring numbers next to a placed
+        end, which extend their segment. Placing a number further in splits its segment in two.
+        A cell that only one number can reach is filled first.
+        """
+        best = None
+        candidates_of = {}
+        reached = reached_twice = 0
+        for lower, upper in segments:
+            for number in range(lower + 1, upper):
+                candidates = self._cells_for(number, lower, upper, reaches[lower, upper]) & regions[lower, upper]
+                candidates_of[number] = (lower, upper), candidates
+                reached_twice |= reached & candidates
+                reached |= candidates
+                key = (candidates.bit_count(), min(number - lower, upper - number), upper - lower)
+                if best is None or key < best[0]:
+                    best = (key, (lower, upper), number, candidates)
+
+        # a cell only one number can reach must hold it
+        single = self._empty & ~reached_twice
+        if single & ~reached:
+            return None, []
+        if single and best[0][0] > 1:
+            cell = (single & -single).bit_length() - 1
+            for number, (segment, candidates) in candidates_of.items():
+                if candidates >> cell & 1:
+                    return segment, [((number, cell),)]
+
+        _, segment, number, candidates = best
+        # cells with the fewest empty neighbors first, as in Warnsdorff's rule
+        cells = sorted(mask_indices(candidates), key=lambda cell: (self._neighbors[cell] & self._empty).bit_count())
+        return segment, [((number, cell),) for cell in cells]
+
+    def _segments(self):
+        size = self.problem.size
+        bounds = [0] + self._placed + [size + 1]
+        return [(lower, upper) for lower, upper in zip(bounds, bounds[1:]) if upper - lower > 1]
+
+    def _length(self, lower, upper):
+        """
+        The number of empty cells the segment has to fill.
+        """
+        return upper - lower - 1
+
+    def _reach(self, lower, upper):
+        """
+        The balls of empty cells around the placed ends of the segment, None for an open end.
+        """
+        steps = upper - lower
+        board = self.problem.board
+        forward = board.balls(1 << self._cell(lower), steps - 1, self._empty) if lower > 0 else None
+        backward = board.balls(1 << self._cell(upper), steps - 1, self._empty) if upper <= self.problem.size else None
+        return forward, backward
+
+    def _cells_for(self, number, lower, upper, reach):
+        """
+        The empty cells close enough to both ends of the segment to hold the number.
+        """
+        forward, backward = reach
+        cells = self._empty
+        if forward is not None:
+            cells &= ball(forward, number - lower)
+        if backward is not None:
+            cells &= ball(backward, upper - number)
+        return cells
+
+    def _region(self, lower, upper, reach):
+        """
+        The empty cells some walk of the segment could pass through.
+        """
+        region = 0
+        for number in range(lower + 1, upper):
+            region |= self._cells_for(number, lower, upper, reach)
+        return region
+
+    def _enumerate_paths(self, lower, upper, region):
+        """
+        Every path of empty cells inside the region from lower to upper, as a tuple of cell indices with the mask
+        of those cells, or None when there are more than PATH_LIMIT of them.
+        """
+        start, end = self._cell(lower), self._cell(upper)
+        key = (start, end, upper - lower, region)
+        if key in self._paths:
+            self._paths.move_to_end(key)
+            return self._paths[key]
+
+        to_end = self.problem.board.balls(1 << end, upper - lower - 1, region)
+        paths = []
+        path = []
+
+        def extend(cell, used, remaining):
+            if remaining == 0:
+                if self._neighbors[cell] >> end & 1:
+                    paths.append((tuple(path), used))
+                return len(paths) <= PATH_LIMIT
+
+            for following in mask_indices(self._neighbors[cell] & region & ~used & ball(to_end, remaining)):
+                path.append(following)
+                within_limit = extend(following, used | 1 << following, remaining - 1)
+                path.pop()
+                if not within_limit:
+                    return False
+            return True
+
+        result = paths if extend(start, 0, upper - lower - 1) else None
+        self._paths[key] = result
+        if len(self._paths) > PATH_CACHE_SIZE:
+            self._paths.popitem(last=False)
+        return result
+
+    def _cell(self, number):
+        x, y = self.problem.board._2d_index(number)
+        return x * self.problem.board.width + y
+
+    def _place(self, placements):
+        board = self.problem.board
+        for number, cell in placements:
+            board.assign(number, divmod(cell, board.width))
+            self._empty &= ~(1 << cell)
+            insort(self._placed, number)
+
+    def _unplace(self, placements):
+        board = self.problem.board
+        for number, cell in placements:
+            board.delete_assignment(number)
+            self._empty |= 1 << cell
+            del self._placed[bisect_left(self._placed, number)]
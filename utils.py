@@ -6,6 +6,16 @@ Move = namedtuple('Move', ['x_pos', 'y_pos', 'number'])
 Swap = namedtuple('Swap', ['x_1', 'y_1', 'x_2', 'y_2'])
 
 
+def subset_sums(lengths):
+    """
+    Bitmask of the sums of the subsets of lengths: bit s is set when some subset adds up to s.
+    """
+    sums = 1
+    for length in lengths:
+        sums |= sums << length
+    return sums
+
+
 def timeit(func):
     def timed_func(*args, **kwargs):
         start = time.time()